@@ -1,23 +1,70 @@
+import asyncio
 import logging
+import time
+
+_import_started = time.perf_counter()
+
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 
 from downloader import VideoDownloader
-from models import DownloadRequest, DownloadResponse
+from models import DownloadRequest, DownloadResponse, JobResponse
 from config import settings
 from cookies_checker import check_cookies
-from storage import get_storage_backend
+from jobs import JobManager
+from storage import get_storage_backend, guess_content_type
 
 app = FastAPI()
-downloader = VideoDownloader()
 storage = get_storage_backend()
+downloader = VideoDownloader(storage=storage)
+jobs = JobManager(
+    runner=lambda job: downloader.download(job.url, job=job, **job.options),
+    max_workers=settings.MAX_CONCURRENT_DOWNLOADS,
+    timeout=settings.DOWNLOAD_TIMEOUT,
+    retention=settings.JOB_RETENTION_SECONDS,
+)
 logger = logging.getLogger(__name__)
 
 if not settings.USE_S3:
     app.mount("/downloads", StaticFiles(directory=str(settings.LOCAL_DOWNLOAD_DIR)), name="downloads")
 
+# Readiness: set once the background warm-up has imported yt-dlp and validated storage
+warm_up_state = {"ready": False, "error": "", "task": None}
+
+logger.info(f"API module imported in {(time.perf_counter() - _import_started) * 1000:.0f} ms")
+
+
+async def _warm_up() -> None:
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(downloader.warm_up)
+        warm_up_state["ready"] = True
+        warm_up_state["error"] = ""
+        logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        warm_up_state["error"] = str(e)
+        logger.error(f"Warm-up failed after {(time.perf_counter() - started) * 1000:.0f} ms: {e}")
+
+
+def _start_warm_up() -> None:
+    task = warm_up_state["task"]
+    if task is None or task.done():
+        warm_up_state["task"] = asyncio.create_task(_warm_up())
+
+
+@app.on_event("startup")
+async def startup():
+    logger.info(f"API started in {(time.perf_counter() - _import_started) * 1000:.0f} ms, warming up in background")
+    _start_warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    jobs.shutdown()
+
+
 @app.get("/")
 async def home():
     return {"message": "Welcome to Video Downloader API",}
@@ -32,6 +79,19 @@ async def health():
     }
 
 
+@app.get("/ready")
+async def ready():
+    if warm_up_state["ready"]:
+        return {"status": "ready"}
+    if warm_up_state["error"]:
+        # Retry in case the failure was transient (e.g. credentials not yet available)
+        _start_warm_up()
+    return JSONResponse(
+        status_code=503,
+        content={"status": "starting", "error": warm_up_state["error"]}
+    )
+
+
 @app.get("/cookies/status")
 async def cookies_status():
     status = check_cookies(settings.YT_DLP_COOKIES_FILE)
@@ -45,27 +105,65 @@ async def cookies_test():
 
 
 @app.post("/download", response_model=DownloadResponse)
-async def download_video(request: DownloadRequest):
-    try:
-        logger.info(f"Starting download: {request.url}")
-        result = downloader.download(str(request.url))
-        
-        if result.get('type') == 'playlist':
-            message = f"Playlist downloaded successfully ({result.get('video_count', 0)} videos)"
-        else:
-            message = "Video downloaded successfully"
-        
-        return {
-            "status": "success",
-            "message": message,
-            "data": result
-        }
+async def download_video(request: DownloadRequest, http_request: Request):
+    logger.info(f"Starting download: {request.url}")
+    job = jobs.submit(str(request.url), options=request.download_options())
+    done = asyncio.wrap_future(job.future)
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Download failed: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+    # Wait for the job without blocking the event loop; stop it if the client goes away
+    while not done.done():
+        await asyncio.wait({done}, timeout=1.0)
+        if not done.done() and await http_request.is_disconnected():
+            logger.info(f"Client disconnected, cancelling job {job.id}")
+            job.cancel()
+            await asyncio.wait({done})
+    
+    if job.status == "timed_out":
+        raise HTTPException(status_code=504, detail=job.error)
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail=job.error)
+    if job.status != "succeeded":
+        logger.error(f"Download failed: {job.error}")
+        raise HTTPException(status_code=500, detail=job.error)
+    
+    result = job.result
+    if result.get('type') == 'playlist':
+        message = f"Playlist downloaded successfully ({result.get('video_count', 0)} videos)"
+    elif result.get('filename'):
+        message = "Video downloaded successfully"
+    else:
+        message = "Artifacts downloaded successfully"
+    
+    return {
+        "status": "success",
+        "message": message,
+        "data": result,
+        "job_id": job.id,
+    }
+
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(request: DownloadRequest):
+    job = jobs.submit(str(request.url), options=request.download_options())
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.cancel():
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job.to_dict()
 
 @app.get("/video/{filename}")
 async def get_video(filename: str):
@@ -92,7 +190,7 @@ async def get_video(filename: str):
         
         return FileResponse(
             path=str(file_path),
-            media_type="video/mp4",
+            media_type=guess_content_type(filename),
             filename=filename
         )
     
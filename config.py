@@ -8,7 +8,11 @@ logger = logging.getLogger(__name__)
 class Settings(BaseSettings):
     LOCAL_DOWNLOAD_DIR: Path = Path("./downloads")
     
+    # Wall-clock deadline for a whole download job (seconds)
     DOWNLOAD_TIMEOUT: int = 900
+    MAX_CONCURRENT_DOWNLOADS: int = 2
+    JOB_RETENTION_SECONDS: int = 3600
+    YT_DLP_SOCKET_TIMEOUT: int = 30
     YT_DLP_MAX_RETRIES: int = 3
     YT_DLP_MAX_FILESIZE: int = 500
     YT_DLP_COOKIES_FILE: Path = Path("")
@@ -19,6 +23,8 @@ class Settings(BaseSettings):
     
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "video_downloader.log"
+    LOG_FORMAT: str = "json"  # "json" or "text"
+    TRACE_FILE: str = ""  # JSON-lines span export, disabled when empty
     
     # Storage: S3 is the primary storage backend for production
     # Use S3 for scalable, persistent video storage
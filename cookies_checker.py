@@ -1,7 +1,8 @@
+import shutil
+import tempfile
 from pathlib import Path
 from datetime import datetime
 from dataclasses import dataclass
-import yt_dlp
 
 
 @dataclass
@@ -27,18 +28,24 @@ class CookiesStatus:
 
 
 def test_cookies_with_youtube(cookies_path: Path) -> tuple[bool, str]:
+    import yt_dlp
+    
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': 'in_playlist',
-            'cookiefile': str(cookies_path),
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info("https://www.youtube.com/watch?v=dQw4w9WgXcQ", download=False)
-            if info:
-                return True, "YouTube access confirmed"
-            return False, "Could not extract video info"
+        # yt-dlp rewrites the cookie file on close; test against a copy so running downloads never see a partial file
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cookies_copy = Path(temp_dir) / "cookies.txt"
+            shutil.copyfile(cookies_path, cookies_copy)
+            ydl_opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': 'in_playlist',
+                'cookiefile': str(cookies_copy),
+            }
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info("https://www.youtube.com/watch?v=dQw4w9WgXcQ", download=False)
+                if info:
+                    return True, "YouTube access confirmed"
+                return False, "Could not extract video info"
     except Exception as e:
         error_msg = str(e).lower()
         auth_errors = ["sign in", "bot", "cookies are no longer valid", "confirm you", "not a bot", "login required"]
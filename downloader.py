@@ -1,92 +1,139 @@
+import contextlib
+import contextvars
 import logging
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Dict
-import yt_dlp
+from typing import Dict, Iterable, List, Optional, Sequence
 import shutil
 
 from config import settings
 from cookies_checker import check_cookies
+from jobs import Job, JobCancelled, current_job
 from storage import get_storage_backend, StorageBackend
+from telemetry import record_span, setup_logging, span
 
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(settings.LOG_FILE),
-        logging.StreamHandler()
-    ]
+setup_logging(
+    level=settings.LOG_LEVEL,
+    log_file=settings.LOG_FILE,
+    log_format=settings.LOG_FORMAT,
+    trace_file=settings.TRACE_FILE,
 )
 
 logger = logging.getLogger(__name__)
 
-class VideoDownloader:
+# Tracking is installed from the warm-up thread and from download workers; patch only once
+_process_tracking_lock = threading.Lock()
+
+
+def _install_process_tracking() -> None:
+    """Register subprocesses spawned by yt-dlp (ffmpeg) with the job running on the current thread."""
+    import yt_dlp.utils
     
-    def _cleanup_partial_downloads(self) -> None:
-        """Clean up partial downloads and fragment files to free disk space."""
-        try:
-            patterns = ['*.part', '*.part-*', '*.ytdl']
-            cleaned = 0
-            for pattern in patterns:
-                for f in self.download_dir.glob(pattern):
-                    try:
-                        f.unlink()
-                        cleaned += 1
-                        logger.debug(f"Cleaned up partial file: {f.name}")
-                    except Exception as e:
-                        logger.warning(f"Could not remove {f.name}: {e}")
-            if cleaned > 0:
-                logger.info(f"Cleaned up {cleaned} partial/fragment files")
-        except Exception as e:
-            logger.warning(f"Cleanup failed: {e}")
+    popen_cls = yt_dlp.utils.Popen
+    with _process_tracking_lock:
+        if getattr(popen_cls, '_job_tracking', False):
+            return
+        original_init = popen_cls.__init__
+
+        def __init__(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            job = current_job()
+            if job is not None:
+                job.register_process(self)
+
+        popen_cls.__init__ = __init__
+        popen_cls._job_tracking = True
+
+
+class VideoDownloader:
     
-    def _find_downloaded_file(self, video_id: str, expected_filename: str) -> Path:
-        """Find the actual downloaded file, handling yt-dlp's format code suffixes."""
-        # First check for the expected merged file
-        if not expected_filename.endswith('.mp4'):
-            expected_filename = expected_filename.rsplit('.', 1)[0] + '.mp4'
-        expected_path = Path(expected_filename)
-        if expected_path.exists():
-            return expected_path
+    def _collect_artifacts(self, entry: Dict, artifacts: Iterable[str], audio_sources: Dict[str, str]) -> List[Dict]:
+        """Gather the files yt-dlp reported for one video, one entry per requested artifact."""
+        video_id = entry.get('id', '')
+        found = []
         
-        # Check for incomplete downloads (.part files)
-        part_files = list(self.download_dir.glob(f'*{video_id}*.part'))
-        if part_files:
-            logger.warning(f"Incomplete download detected for video {video_id}: {[f.name for f in part_files]}")
+        # After post-processing, requested_downloads holds the final file: the audio track when
+        # audio was extracted, otherwise the converted video
+        final_path = None
+        if 'video' in artifacts or 'audio' in artifacts:
+            for download in entry.get('requested_downloads') or []:
+                if download.get('filepath') and Path(download['filepath']).exists():
+                    final_path = Path(download['filepath'])
         
-        # Search for any file matching *{video_id}.* pattern
-        # Exclude .part files (incomplete downloads)
-        matching_files = list(self.download_dir.glob(f'*{video_id}.*'))
-        valid_files = [f for f in matching_files if f.suffix != '.part']
+        if 'video' in artifacts:
+            # With audio extraction the video is the file ExtractAudio started from
+            video_path = Path(audio_sources[video_id]) if 'audio' in artifacts and video_id in audio_sources else final_path
+            if video_path and video_path.exists():
+                found.append({'type': 'video', 'path': video_path})
         
-        # Separate merged files from format-coded files (e.g., .f251.webm)
-        merged_files = [f for f in valid_files if '.f' not in f.name]
-        format_coded_files = [f for f in valid_files if '.f' in f.name]
+        if 'audio' in artifacts:
+            if final_path and video_id in audio_sources:
+                found.append({'type': 'audio', 'path': final_path})
+            else:
+                logger.warning(f"Audio track not produced for video {video_id}")
         
-        if merged_files:
-            # Prefer merged files
-            for ext in ['.mp4', '.webm', '.mkv']:
-                for f in merged_files:
-                    if f.suffix == ext:
-                        return f
-            return merged_files[0]
+        if 'thumbnail' in artifacts:
+            thumbnail_paths = [t['filepath'] for t in entry.get('thumbnails') or [] if t.get('filepath')]
+            if thumbnail_paths and Path(thumbnail_paths[-1]).exists():
+                found.append({'type': 'thumbnail', 'path': Path(thumbnail_paths[-1])})
+            else:
+                logger.warning(f"No thumbnail available for video {video_id}")
         
-        if format_coded_files:
-            # Format-coded files indicate merge didn't happen - log warning
-            logger.warning(f"Found unmerged format-coded files for video {video_id}. FFmpeg merge may have failed.")
-            # Prefer video+audio combined formats, then video-only, then audio-only
-            # Common video format codes are typically higher numbers
-            for ext in ['.mp4', '.webm', '.mkv']:
-                video_files = [f for f in format_coded_files if f.suffix == ext and not f.name.endswith(('.f251.webm', '.f250.webm', '.f249.webm'))]
-                if video_files:
-                    return video_files[0]
-            return format_coded_files[0]
+        return found
+    
+    def _fetch_subtitles(self, sub_ydl, entry: Dict, languages: Sequence[str], job: Optional[Job]) -> List[Dict]:
+        """Write subtitles for an already extracted video. Best-effort: failures are reported, not raised."""
+        video_id = entry.get('id', '')
+        try:
+            result = sub_ydl.process_ie_result(sub_ydl.sanitize_info(entry, remove_private_keys=True), download=True)
+            requested = (result or {}).get('requested_subtitles') or {}
+        except Exception as e:
+            if job is not None and job.is_cancelled:
+                raise
+            logger.warning(f"Subtitle download failed for video {video_id}: {e}")
+            return [{'type': 'subtitles', 'language': language, 'error': str(e)} for language in languages]
         
-        return None
+        found = []
+        for language in languages:
+            sub_info = requested.get(language)
+            if sub_info is None:
+                found.append({'type': 'subtitles', 'language': language, 'error': "Not available"})
+            elif sub_info.get('filepath') and Path(sub_info['filepath']).exists():
+                found.append({'type': 'subtitles', 'language': language, 'path': Path(sub_info['filepath'])})
+            else:
+                found.append({'type': 'subtitles', 'language': language, 'error': "Download failed"})
+        return found
+    
+    def _store_artifacts(self, found: List[Dict], job: Optional[Job]) -> List[Dict]:
+        stored = []
+        for artifact in found:
+            if 'path' not in artifact:
+                # Failed best-effort artifact (e.g. subtitles); listed with its error
+                stored.append(artifact)
+                continue
+            if job is not None:
+                job.raise_if_cancelled()
+            path = artifact.pop('path')
+            with span("storage.save_file", filename=path.name, artifact=artifact['type']):
+                file_url = self.storage.save_file(path, path.name)
+            stored.append({**artifact, 'filename': path.name, 'download_url': file_url})
+        return stored
     
-    def __init__(self):
-        self.storage: StorageBackend = get_storage_backend()
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        self.storage: StorageBackend = storage or get_storage_backend()
         self.download_dir = self.storage.get_download_dir()
         
+        storage_type = "S3" if settings.USE_S3 else "local"
+        logger.info(f"Storage backend: {storage_type} ({self.download_dir})")
+    
+    def warm_up(self) -> None:
+        """Do the slow start-up work (yt-dlp import, storage and cookie checks) off the import path."""
+        import yt_dlp  # noqa: F401 - pulls in every extractor module
+        _install_process_tracking()
+        self.storage.validate()
+        
         cookies_status = check_cookies(settings.YT_DLP_COOKIES_FILE)
         if cookies_status.status == "valid":
             logger.info(f"Cookies valid: {cookies_status.message}")
@@ -98,16 +145,67 @@ class VideoDownloader:
             logger.warning("No cookies file - YouTube may block downloads")
         else:
             logger.warning(f"Cookies status: {cookies_status.message}")
-        
-        storage_type = "S3" if settings.USE_S3 else "local"
-        logger.info(f"Storage backend: {storage_type} ({self.download_dir})")
     
-    def download(self, url: str) -> Dict:
-        logger.info(f"Starting download for URL: {url}")
+    def download(
+        self,
+        url: str,
+        job: Optional[Job] = None,
+        artifacts: Iterable[str] = ('video',),
+        audio_format: str = 'm4a',
+        subtitle_languages: Sequence[str] = ('en',),
+    ) -> Dict:
+        import yt_dlp
+        _install_process_tracking()
+        
+        artifacts = set(artifacts)
+        logger.info(f"Starting download for URL: {url} (artifacts: {', '.join(sorted(artifacts))})")
+        stage_started = {}
+        # Input file of ExtractAudio per video id, i.e. the video the audio track was cut from
+        audio_sources = {}
+        # yt-dlp logs and calls hooks from its fragment-download threads too, where context
+        # variables are not set; tag its logger explicitly and run hooks in the job's context
+        ydl_logger = logging.LoggerAdapter(logger, {'job_id': job.id if job is not None else ''})
+        hook_context = None
+        # Each job writes into its own directory so parallel jobs for the same video never share files
+        work_dir = self.download_dir / (job.id if job is not None else uuid.uuid4().hex)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        
+        def check_job(d: Dict) -> None:
+            # Called by yt-dlp for every progress and post-processor update
+            if hook_context is None:
+                on_progress(d)
+            else:
+                hook_context.copy().run(on_progress, d)
+        
+        def on_progress(d: Dict) -> None:
+            video_id = (d.get('info_dict') or {}).get('id')
+            
+            if d.get('postprocessor') == 'ExtractAudio' and d['status'] == 'started':
+                audio_sources[video_id] = d['info_dict'].get('filepath')
+            
+            if 'postprocessor' in d:
+                name, key = 'yt_dlp.post_process', (d['postprocessor'], video_id)
+                started, ended = d['status'] == 'started', d['status'] == 'finished'
+            else:
+                name, key = 'yt_dlp.download', d.get('filename')
+                started, ended = d['status'] == 'downloading', d['status'] in ('finished', 'error')
+            if started:
+                stage_started.setdefault(key, time.time_ns())
+            elif ended and key in stage_started:
+                record_span(
+                    name, stage_started.pop(key), time.time_ns(),
+                    status="ERROR" if d['status'] == 'error' else "OK",
+                    video_id=video_id,
+                    postprocessor=d.get('postprocessor'),
+                    bytes=d.get('total_bytes') or d.get('downloaded_bytes'),
+                )
+            
+            if job is not None:
+                job.raise_if_cancelled()
         
         try:
             output_template = "%(playlist_index|)svideo_%(id)s.%(ext)s"
-            output_path = self.download_dir / output_template
+            output_path = work_dir / output_template
             
             ydl_opts = {
                 'format': (
@@ -119,19 +217,18 @@ class VideoDownloader:
                 ),
                 'outtmpl': str(output_path),
                 'merge_output_format': 'mp4',
-                'postprocessors': [{
-                    'key': 'FFmpegVideoConvertor',
-                    'preferedformat': 'mp4',
-                }],
+                'postprocessors': [],
                 'noplaylist': False,
                 'yes_playlist': True,
-                'quiet': False,
+                # Progress lines are only useful interactively; warnings and errors still reach the logger
+                'quiet': True,
+                'noprogress': True,
                 'no_warnings': False,
                 'extract_flat': False,
-                'socket_timeout': settings.DOWNLOAD_TIMEOUT,
+                'socket_timeout': settings.YT_DLP_SOCKET_TIMEOUT,
                 'retries': settings.YT_DLP_MAX_RETRIES,
                 'max_filesize': settings.YT_DLP_MAX_FILESIZE * 1024 * 1024,
-                'logger': logger,
+                'logger': ydl_logger,
                 'js_runtimes': {'node': {}},
                 # Speed optimizations
                 'concurrent_fragment_downloads': 8,  # Parallel fragment downloads for DASH/HLS (increase for more speed)
@@ -140,14 +237,77 @@ class VideoDownloader:
                 'sleep_interval': 5,
                 'max_sleep_interval': 15,
                 'sleep_requests': 1,
+                'progress_hooks': [check_job],
+                'postprocessor_hooks': [check_job],
             }
             
+            # All artifacts come from one extract_info; audio is cut from the same media fetch as the video
+            postprocessors = ydl_opts['postprocessors']
+            if 'video' in artifacts:
+                postprocessors.append({
+                    'key': 'FFmpegVideoConvertor',
+                    'preferedformat': 'mp4',
+                })
+            elif 'audio' in artifacts:
+                ydl_opts['format'] = 'bestaudio/best'
+            else:
+                ydl_opts['skip_download'] = True
+            
+            if 'audio' in artifacts:
+                postprocessors.append({
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': audio_format,
+                })
+                # Keep the video file the audio was extracted from
+                ydl_opts['keepvideo'] = 'video' in artifacts
+            
+            if 'thumbnail' in artifacts:
+                ydl_opts['writethumbnail'] = True
+                postprocessors.append({
+                    'key': 'FFmpegThumbnailsConvertor',
+                    'format': 'jpg',
+                    'when': 'before_dl',
+                })
+            
             if settings.cookies_file_exists:
-                ydl_opts['cookiefile'] = str(settings.YT_DLP_COOKIES_FILE)
+                # yt-dlp rewrites its cookie file in place on close; a private copy per job keeps
+                # parallel jobs from reading a half-written jar or overwriting each other's updates
+                cookies_path = work_dir / 'cookies.txt'
+                shutil.copyfile(settings.YT_DLP_COOKIES_FILE, cookies_path)
+                ydl_opts['cookiefile'] = str(cookies_path)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Subtitles are written in a second pass over the already extracted info (no new
+            # extraction, no media fetch) so that a failed subtitle fetch cannot fail the video
+            sub_opts = {
+                key: ydl_opts[key] for key in (
+                    'outtmpl', 'quiet', 'noprogress', 'no_warnings', 'socket_timeout', 'retries',
+                    'logger', 'js_runtimes', 'sleep_requests', 'progress_hooks', 'postprocessor_hooks',
+                    'cookiefile',
+                ) if key in ydl_opts
+            }
+            sub_opts.update({
+                'skip_download': True,
+                'writesubtitles': True,
+                'writeautomaticsub': True,
+                'subtitleslangs': list(subtitle_languages),
+                'subtitlesformat': 'vtt/best',
+                'ignoreerrors': True,  # subtitle errors become warnings; failures are listed per language
+                'postprocessors': [{
+                    'key': 'FFmpegSubtitlesConvertor',
+                    'format': 'vtt',
+                    'when': 'before_dl',
+                }],
+            })
+            
+            with contextlib.ExitStack() as stack:
+                ydl = stack.enter_context(yt_dlp.YoutubeDL(ydl_opts))
+                # Only build the subtitle instance when needed: every YoutubeDL loads and rewrites the cookie jar
+                sub_ydl = stack.enter_context(yt_dlp.YoutubeDL(sub_opts)) if 'subtitles' in artifacts else None
+                
                 logger.info("Extracting video/playlist info...")
-                info = ydl.extract_info(url, download=True)
+                with span("yt_dlp.extract_info", url=url):
+                    hook_context = contextvars.copy_context()
+                    info = ydl.extract_info(url, download=True)
                 is_playlist = 'entries' in info
                 
                 if is_playlist:
@@ -157,53 +317,72 @@ class VideoDownloader:
                     
                     filenames = []
                     download_urls = []
+                    stored_artifacts = []
+                    stored_count = 0
                     
                     for entry in entries:
                         if entry:
+                            if job is not None:
+                                job.raise_if_cancelled()
                             video_id = entry.get('id', '')
-                            expected_filename = ydl.prepare_filename(entry)
-                            filepath = self._find_downloaded_file(video_id, expected_filename)
+                            found = self._collect_artifacts(entry, artifacts, audio_sources)
+                            if 'subtitles' in artifacts:
+                                found += self._fetch_subtitles(sub_ydl, entry, subtitle_languages, job)
                             
-                            if filepath and filepath.exists():
-                                file_url = self.storage.save_file(filepath, filepath.name)
-                                filenames.append(filepath.name)
-                                download_urls.append(file_url)
+                            if any('path' in a for a in found):
+                                stored_count += 1
+                            for artifact in self._store_artifacts(found, job):
+                                if artifact['type'] == 'video':
+                                    filenames.append(artifact['filename'])
+                                    download_urls.append(artifact['download_url'])
+                                stored_artifacts.append({**artifact, 'video_id': video_id})
                     
                     return {
                         'status': 'success',
                         'type': 'playlist',
                         'platform': info.get('extractor', ''),
                         'playlist_title': info.get('title', ''),
-                        'video_count': len(filenames),
+                        'video_count': stored_count,
                         'filenames': filenames,
                         'download_urls': download_urls,
+                        'artifacts': stored_artifacts,
                     }
                 else:
                     video_id = info.get('id', '')
-                    expected_filename = ydl.prepare_filename(info)
-                    filepath = self._find_downloaded_file(video_id, expected_filename)
+                    found = self._collect_artifacts(info, artifacts, audio_sources)
+                    if 'subtitles' in artifacts:
+                        found += self._fetch_subtitles(sub_ydl, info, subtitle_languages, job)
                     
-                    if not filepath or not filepath.exists():
+                    if 'video' in artifacts and not any(a['type'] == 'video' for a in found):
                         raise FileNotFoundError(f"Downloaded file not found for video ID {video_id}")
+                    produced = [a['path'].name for a in found if 'path' in a]
+                    if not produced:
+                        raise FileNotFoundError(f"No requested artifacts were produced for video ID {video_id}")
                     
-                    logger.info(f"Download successful: {filepath.name}")
+                    logger.info(f"Download successful: {', '.join(produced)}")
                     
-                    file_url = self.storage.save_file(filepath, filepath.name)
+                    stored_artifacts = self._store_artifacts(found, job)
+                    video = next((a for a in stored_artifacts if a['type'] == 'video'), {})
                     
                     return {
                         'status': 'success',
                         'type': 'video',
                         'platform': info.get('extractor', ''),
                         'video_title': info.get('title', ''),
-                        'filename': filepath.name,
-                        'download_url': file_url
+                        'filename': video.get('filename'),
+                        'download_url': video.get('download_url'),
+                        'artifacts': stored_artifacts,
                     }
                 
         except Exception as e:
-            # Clean up partial downloads on failure to free disk space
-            self._cleanup_partial_downloads()
+            if job is not None and job.is_cancelled:
+                raise JobCancelled(str(e))
             if "DownloadError" in type(e).__name__:
                 logger.error(f"Download error: {str(e)}")
                 raise Exception(f"Failed to download video: {str(e)}")
             logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-            raise Exception(f"Error during download: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error during download: {str(e)}")
+        finally:
+            # Stored artifacts have been moved or uploaded by now; whatever is left (partial
+            # downloads, merge inputs, files of a cancelled or failed job) belongs to this job only
+            shutil.rmtree(work_dir, ignore_errors=True)
\ No newline at end of file
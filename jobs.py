@@ -0,0 +1,195 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from telemetry import job_id_var, span
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled", "timed_out")
+
+# A context variable rather than a thread-local so that code run under a copied
+# job context (e.g. yt-dlp hooks on its fragment threads) still sees the job
+_current_job_var: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled or has hit its deadline."""
+
+
+@dataclass
+class Job:
+    id: str
+    url: str
+    timeout: int
+    options: dict = field(default_factory=dict)
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: str = ""
+    cancel_reason: str = ""
+    future: Optional[Future] = field(default=None, repr=False)
+    _cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _processes: List = field(default_factory=list, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def raise_if_cancelled(self) -> None:
+        """Cooperative cancellation point, called from yt-dlp progress/post-processor hooks."""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self._cancel_message())
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Cancel a queued or running job. Returns False if it already finished."""
+        with self._lock:
+            if self.is_finished or self._cancel_event.is_set():
+                return False
+            self.cancel_reason = reason
+            self._cancel_event.set()
+            processes = list(self._processes)
+
+        # A job that never left the queue can be finished right here
+        if self.future is not None and self.future.cancel():
+            self.finish(reason, error=self._cancel_message())
+            logger.info(f"Job {self.id} cancelled before it started")
+            return True
+
+        for proc in processes:
+            self._kill_process(proc)
+        logger.info(f"Job {self.id} {reason}, killed {len(processes)} subprocess(es)")
+        return True
+
+    def register_process(self, proc) -> None:
+        """Track a subprocess (e.g. ffmpeg) so that cancellation can kill it."""
+        with self._lock:
+            self._processes.append(proc)
+            cancelled = self._cancel_event.is_set()
+        if cancelled:
+            self._kill_process(proc)
+
+    def finish(self, status: str, result: Optional[dict] = None, error: str = "") -> None:
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self._processes.clear()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "url": self.url,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "data": self.result,
+        }
+
+    def _cancel_message(self) -> str:
+        if self.cancel_reason == "timed_out":
+            return f"Job exceeded its {self.timeout}s deadline"
+        return "Job cancelled"
+
+    @staticmethod
+    def _kill_process(proc) -> None:
+        try:
+            if proc.poll() is None:
+                proc.kill()
+        except Exception as e:
+            logger.warning(f"Could not kill subprocess {getattr(proc, 'pid', '?')}: {e}")
+
+
+def current_job() -> Optional[Job]:
+    """Return the job running in the current context, if any."""
+    return _current_job_var.get()
+
+
+class JobManager:
+    """Runs download jobs on a bounded thread pool with a per-job wall-clock deadline."""
+
+    def __init__(self, runner: Callable[[Job], dict], max_workers: int, timeout: int, retention: int):
+        self._runner = runner
+        self._timeout = timeout
+        self._retention = retention
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+
+    def submit(self, url: str, options: Optional[dict] = None) -> Job:
+        self._prune()
+        job = Job(id=uuid.uuid4().hex, url=url, timeout=self._timeout, options=options or {})
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        logger.info(f"Queued job {job.id} for {url}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: Job) -> None:
+        # Never raises: the outcome is recorded on the job itself
+        if job.is_cancelled:
+            job.finish(job.cancel_reason, error=job._cancel_message())
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        deadline = threading.Timer(job.timeout, job.cancel, kwargs={"reason": "timed_out"})
+        deadline.daemon = True
+        deadline.start()
+        current_token = _current_job_var.set(job)
+        job_token = job_id_var.set(job.id)
+
+        try:
+            # The runner checks for cancellation before each upload; once it returns, its stored result stands
+            with span("job", url=job.url):
+                result = self._runner(job)
+            job.finish("succeeded", result=result)
+            logger.info(f"Job {job.id} succeeded in {job.finished_at - job.started_at:.1f}s")
+        except Exception as e:
+            if job.is_cancelled:
+                job.finish(job.cancel_reason, error=job._cancel_message())
+                logger.warning(f"Job {job.id} stopped: {job.error}")
+            else:
+                job.finish("failed", error=str(e))
+                logger.error(f"Job {job.id} failed: {e}")
+        finally:
+            deadline.cancel()
+            _current_job_var.reset(current_token)
+            job_id_var.reset(job_token)
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the retention window."""
+        cutoff = time.time() - self._retention
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.is_finished and job.finished_at and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
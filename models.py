@@ -1,4 +1,5 @@
 import re
+from typing import List, Literal, Optional, Set
 from pydantic import BaseModel, HttpUrl, Field, field_validator
 
 PLATFORM_URL_PATTERNS = {
@@ -20,8 +21,24 @@ PLATFORM_URL_PATTERNS = {
 }
 
 
+ArtifactType = Literal["video", "audio", "thumbnail", "subtitles"]
+
+# Plain language codes only: yt-dlp treats "all" as select-everything and a leading "-" as an exclusion
+SUBTITLE_LANGUAGE_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_\-]*$")
+MAX_SUBTITLE_LANGUAGES = 5
+
+
 class DownloadRequest(BaseModel):
     url: HttpUrl = Field(..., description="Video URL to download")
+    artifacts: Set[ArtifactType] = Field(
+        default_factory=lambda: {"video"},
+        description="Outputs to produce from a single fetch: video, audio, thumbnail, subtitles"
+    )
+    audio_format: Literal["m4a", "opus"] = Field("m4a", description="Format of the audio-only track")
+    subtitle_languages: List[str] = Field(
+        default_factory=lambda: ["en"],
+        description="Subtitle language codes, e.g. en, es, pt-BR"
+    )
 
     @field_validator("url")
     @classmethod
@@ -31,14 +48,53 @@ class DownloadRequest(BaseModel):
             raise ValueError("Only YouTube, Facebook, and X URLs are supported.")
         return value
     
+    @field_validator("artifacts")
+    @classmethod
+    def validate_artifacts(cls, value: Set[str]) -> Set[str]:
+        if not value:
+            raise ValueError("At least one artifact must be requested.")
+        return value
+    
+    @field_validator("subtitle_languages")
+    @classmethod
+    def validate_subtitle_languages(cls, value: List[str]) -> List[str]:
+        if not value:
+            raise ValueError("At least one subtitle language must be given.")
+        if len(value) > MAX_SUBTITLE_LANGUAGES:
+            raise ValueError(f"At most {MAX_SUBTITLE_LANGUAGES} subtitle languages can be requested.")
+        for language in value:
+            if language.lower() == "all" or not SUBTITLE_LANGUAGE_PATTERN.match(language):
+                raise ValueError(f"Invalid subtitle language code: {language}")
+        return list(dict.fromkeys(value))
+    
+    def download_options(self) -> dict:
+        return {
+            "artifacts": sorted(self.artifacts),
+            "audio_format": self.audio_format,
+            "subtitle_languages": self.subtitle_languages,
+        }
+    
     class Config:
         json_schema_extra = {
             "example": {
-                "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+                "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                "artifacts": ["video", "thumbnail"]
             }
         }
 
 class DownloadResponse(BaseModel):
     status: str
     message: str
-    data: dict
\ No newline at end of file
+    data: dict
+    job_id: Optional[str] = None
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    url: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: str = ""
+    data: Optional[dict] = None
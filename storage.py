@@ -1,13 +1,37 @@
+import hashlib
 import logging
+import mimetypes
 import os
+import threading
 import time
 from abc import ABC, abstractmethod
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from urllib.parse import quote
 
+from telemetry import span
+
 logger = logging.getLogger(__name__)
 
+# S3 layout: video bytes are stored once per SHA-256 digest, and each
+# user-facing filename (video_<id>.mp4) is a tiny manifest object pointing at them
+CONTENT_PREFIX = "videos/sha256/"
+MANIFEST_PREFIX = "manifest/"
+
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.opus': 'audio/ogg',
+    '.jpg': 'image/jpeg',
+    '.vtt': 'text/vtt',
+}
+
+
+def guess_content_type(filename: str) -> str:
+    suffix = Path(filename).suffix.lower()
+    return CONTENT_TYPES.get(suffix) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
 
 class StorageBackend(ABC):
     @abstractmethod
@@ -26,6 +50,10 @@ class StorageBackend(ABC):
     def get_download_dir(self) -> Path:
         pass
 
+    def validate(self) -> None:
+        """Check that the backend is usable. Raises on failure; called from the startup warm-up."""
+        pass
+
 
 class LocalStorage(StorageBackend):
     def __init__(self, download_dir: Path):
@@ -34,6 +62,10 @@ class LocalStorage(StorageBackend):
         logger.info(f"Local storage initialized: {self.download_dir}")
 
     def save_file(self, local_path: Path, remote_name: str) -> str:
+        # Downloads land in a per-job working directory; publish them next to the static mount
+        target = self.download_dir / remote_name
+        if local_path.resolve() != target.resolve():
+            local_path.replace(target)
         return f"/downloads/{remote_name}"
 
     def get_file_url(self, filename: str) -> str:
@@ -52,37 +84,60 @@ class S3Storage(StorageBackend):
         self.region = region
         self._local_temp_dir = Path("/tmp/downloads")
         self._local_temp_dir.mkdir(parents=True, exist_ok=True)
-        
+        # boto3 is imported and the client built on first use to keep process start-up fast
+        self._s3_client = None
+        self._client_lock = threading.Lock()
+        self._validated = False
+        # filename -> content key, filled from save_file() and manifest lookups
+        self._content_keys = {}
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            with self._client_lock:
+                if self._s3_client is None:
+                    self._s3_client = self._create_client()
+        return self._s3_client
+
+    def _create_client(self):
         try:
             import boto3
             from botocore.config import Config
-            from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
-            
-            config = Config(
-                signature_version='s3v4',
-                s3={'addressing_style': 'virtual'},
-                retries={'max_attempts': 3, 'mode': 'standard'}
-            )
-            self.s3_client = boto3.client(
-                's3',
-                region_name=region,
-                endpoint_url=f'https://s3.{region}.amazonaws.com',
-                config=config
-            )
-            
-            # Validate bucket access on initialization
-            try:
-                self.s3_client.head_bucket(Bucket=bucket_name)
-                logger.info(f"S3 storage initialized: bucket={bucket_name}, region={region}")
-            except ClientError as e:
-                error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-                if error_code == '404':
-                    raise Exception(f"S3 bucket '{bucket_name}' does not exist in region {region}")
-                elif error_code == '403':
-                    raise Exception(f"Access denied to S3 bucket '{bucket_name}'. Check IAM permissions.")
-                else:
-                    raise Exception(f"Cannot access S3 bucket '{bucket_name}': {error_code}")
-                    
+        except ImportError as e:
+            logger.error(f"Failed to import boto3: {e}")
+            raise Exception("boto3 not installed. Run: pip install boto3")
+        
+        config = Config(
+            signature_version='s3v4',
+            s3={'addressing_style': 'virtual'},
+            retries={'max_attempts': 3, 'mode': 'standard'}
+        )
+        return boto3.client(
+            's3',
+            region_name=self.region,
+            endpoint_url=f'https://s3.{self.region}.amazonaws.com',
+            config=config
+        )
+
+    def validate(self) -> None:
+        if self._validated:
+            return
+        
+        client = self.s3_client
+        from botocore.exceptions import NoCredentialsError, ClientError
+        
+        try:
+            client.head_bucket(Bucket=self.bucket_name)
+            self._validated = True
+            logger.info(f"S3 storage initialized: bucket={self.bucket_name}, region={self.region}")
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+            if error_code == '404':
+                raise Exception(f"S3 bucket '{self.bucket_name}' does not exist in region {self.region}")
+            elif error_code == '403':
+                raise Exception(f"Access denied to S3 bucket '{self.bucket_name}'. Check IAM permissions.")
+            else:
+                raise Exception(f"Cannot access S3 bucket '{self.bucket_name}': {error_code}")
         except NoCredentialsError:
             logger.error("AWS credentials not found. Ensure IAM instance profile is attached to EC2.")
             raise Exception(
@@ -90,40 +145,34 @@ class S3Storage(StorageBackend):
                 "For EC2: Attach IAM instance profile. "
                 "For local: Configure AWS CLI with 'aws configure'."
             )
-        except ImportError as e:
-            logger.error(f"Failed to import boto3: {e}")
-            raise Exception("boto3 not installed. Run: pip install boto3")
-        except Exception as e:
-            logger.error(f"Failed to initialize S3 storage: {e}", exc_info=True)
-            raise
 
     def save_file(self, local_path: Path, remote_name: str) -> str:
-        s3_key = f"videos/{remote_name}"
-        logger.info(f"Uploading {local_path} to s3://{self.bucket_name}/{s3_key}")
-        
-        # Retry logic with exponential backoff
-        max_retries = 3
-        retry_delay = 1  # seconds
+        with span("storage.hash", size=local_path.stat().st_size):
+            digest = self._hash_file(local_path)
+        content_key = f"{CONTENT_PREFIX}{digest}{local_path.suffix}"
         
-        for attempt in range(max_retries):
-            try:
-                self.s3_client.upload_file(
+        if self._object_exists(content_key):
+            logger.info(f"Content of {remote_name} already stored as {content_key}, skipping upload")
+        else:
+            logger.info(f"Uploading {local_path} to s3://{self.bucket_name}/{content_key}")
+            with span("storage.upload", key=content_key):
+                self._with_retries("upload", lambda: self.s3_client.upload_file(
                     str(local_path),
                     self.bucket_name,
-                    s3_key,
-                    ExtraArgs={'ContentType': 'video/mp4'}
-                )
-                logger.info(f"Successfully uploaded to S3: {s3_key}")
-                break
-                
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Upload attempt {attempt + 1} failed: {e}. Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    logger.error(f"Failed to upload to S3 after {max_retries} attempts: {e}")
-                    raise Exception(f"S3 upload failed: {e}")
+                    content_key,
+                    ExtraArgs={'ContentType': guess_content_type(local_path.name)}
+                ))
+            logger.info(f"Successfully uploaded to S3: {content_key}")
+        
+        # Re-saving the same filename with the same content needs no PUT at all
+        if self._resolve_key(remote_name) != content_key:
+            self._with_retries("manifest update", lambda: self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=f"{MANIFEST_PREFIX}{remote_name}",
+                Body=content_key.encode(),
+                ContentType='text/plain'
+            ))
+            self._content_keys[remote_name] = content_key
         
         # Clean up local file after successful upload
         try:
@@ -132,24 +181,73 @@ class S3Storage(StorageBackend):
         except Exception as e:
             logger.warning(f"Could not remove local file: {e}")
         
-        return self.get_file_url(remote_name)
+        return self._object_url(content_key)
 
     def get_file_url(self, filename: str) -> str:
-        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/videos/{filename}"
+        return self._object_url(self._resolve_key(filename) or f"videos/{filename}")
 
     def file_exists(self, filename: str) -> bool:
-        s3_key = f"videos/{filename}"
+        return self._resolve_key(filename) is not None
+
+    def _resolve_key(self, filename: str) -> Optional[str]:
+        """Map a filename to its content-addressed key via the manifest, falling back to the legacy videos/<filename> layout."""
+        content_key = self._content_keys.get(filename)
+        if content_key:
+            return content_key
+        
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=f"{MANIFEST_PREFIX}{filename}")
+            content_key = response['Body'].read().decode().strip()
+            self._content_keys[filename] = content_key
+            return content_key
+        except Exception:
+            pass
+        
+        legacy_key = f"videos/{filename}"
+        if self._object_exists(legacy_key):
+            return legacy_key
+        return None
+
+    def _object_exists(self, s3_key: str) -> bool:
         try:
             self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
             return True
         except Exception:
             return False
 
+    def _object_url(self, s3_key: str) -> str:
+        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{s3_key}"
+
+    @staticmethod
+    def _hash_file(local_path: Path) -> str:
+        with open(local_path, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+
+    def _with_retries(self, action: str, func) -> None:
+        # Retry logic with exponential backoff
+        max_retries = 3
+        retry_delay = 1  # seconds
+        
+        for attempt in range(max_retries):
+            try:
+                func()
+                return
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    logger.warning(f"S3 {action} attempt {attempt + 1} failed: {e}. Retrying in {retry_delay}s...")
+                    time.sleep(retry_delay)
+                    retry_delay *= 2  # Exponential backoff
+                else:
+                    logger.error(f"S3 {action} failed after {max_retries} attempts: {e}")
+                    raise Exception(f"S3 {action} failed: {e}")
+
     def get_download_dir(self) -> Path:
         return self._local_temp_dir
 
 
+@lru_cache(maxsize=None)
 def get_storage_backend() -> StorageBackend:
+    """Return the process-wide storage backend, creating it on first call."""
     from config import settings
     
     if settings.USE_S3 and settings.S3_BUCKET_NAME:
@@ -0,0 +1,147 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+# Set by JobManager on the worker thread; every log record and span emitted
+# while the job runs (yt-dlp hooks, storage calls) picks it up automatically
+job_id_var: ContextVar[str] = ContextVar("job_id", default="")
+_span_id_var: ContextVar[str] = ContextVar("span_id", default="")
+
+# Span export is off until setup_logging() is given a trace file
+_span_logger = logging.getLogger("telemetry.spans")
+_span_logger.propagate = False
+_span_logger.disabled = True
+_listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "job_id", ""):
+            entry["job_id"] = record.job_id
+        if getattr(record, "span_id", ""):
+            entry["span_id"] = record.span_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """Queue handler that captures job/span context on the emitting thread and leaves all I/O to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        # An explicit job_id (e.g. from the yt-dlp LoggerAdapter) wins, since the record
+        # may come from a thread the job context was never copied into
+        record.job_id = getattr(record, "job_id", "") or job_id_var.get()
+        record.span_id = _span_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener(target_logger: logging.Logger, *handlers: logging.Handler) -> None:
+    log_queue = queue.SimpleQueue()
+    target_logger.addHandler(_ContextQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def _stop_listeners() -> None:
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+
+
+def setup_logging(level: str, log_file: str, log_format: str = "json", trace_file: str = "") -> None:
+    """Route all logging through a queue so file/console writes happen off the request path."""
+    if _listeners:
+        return
+
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level))
+    _start_listener(root, *handlers)
+
+    # Finished spans are written as JSON lines to their own file, ready for a collector to tail
+    if trace_file:
+        span_handler = logging.FileHandler(trace_file)
+        span_handler.setFormatter(logging.Formatter('%(message)s'))
+        _span_logger.setLevel(logging.INFO)
+        _span_logger.disabled = False
+        _start_listener(_span_logger, span_handler)
+
+    atexit.register(_stop_listeners)
+
+
+def _export_span(name: str, span_id: str, parent_id: str, start_ns: int, end_ns: int, status: str, attributes: dict) -> None:
+    duration_ms = (end_ns - start_ns) / 1e6
+    logger.debug(f"Span {name} finished in {duration_ms:.1f} ms ({status})")
+    if _span_logger.disabled:
+        return
+    _span_logger.info(json.dumps({
+        "name": name,
+        "trace_id": job_id_var.get() or secrets.token_hex(16),
+        "span_id": span_id,
+        "parent_span_id": parent_id,
+        "start_time_unix_nano": start_ns,
+        "end_time_unix_nano": end_ns,
+        "duration_ms": round(duration_ms, 3),
+        "status": status,
+        "attributes": attributes,
+    }, default=str))
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a span nested under the current one. Yields the attribute dict so callers can add to it."""
+    span_id = secrets.token_hex(8)
+    parent_id = _span_id_var.get()
+    token = _span_id_var.set(span_id)
+    start_ns = time.time_ns()
+    status = "OK"
+    try:
+        yield attributes
+    except BaseException as e:
+        status = "ERROR"
+        attributes["error"] = str(e)
+        raise
+    finally:
+        _span_id_var.reset(token)
+        _export_span(name, span_id, parent_id, start_ns, time.time_ns(), status, attributes)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, status: str = "OK", **attributes) -> None:
+    """Record a span whose start and end were observed separately, e.g. from yt-dlp hooks."""
+    _export_span(name, secrets.token_hex(8), _span_id_var.get(), start_ns, end_ns, status, attributes)